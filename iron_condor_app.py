@@ -1,84 +1,158 @@
-# BTC Iron Condor Full Streamlit App with Greeks and Live Data + Fallback for scipy
+# BTC Iron Condor Full Streamlit App with Greeks and Live Data
 
 import streamlit as st
 import numpy as np
-import matplotlib.pyplot as plt
-import requests
 import pandas as pd
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 import math
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
-# === Safe import of scipy ===
-try:
-    from scipy.stats import norm
-except ModuleNotFoundError:
-    st.error("\u26a0\ufe0f The required module 'scipy' is not installed. Please run: pip install scipy")
-    st.stop()
+# Heavy modules (requests, orjson, scipy, numba, altair) are imported where they are
+# first used, so the page starts drawing before they load.
 
 st.set_page_config(page_title="BTC Iron Condor Payoff Calculator", layout="wide")
 st.title("BTC Iron Condor Payoff Calculator")
 
+# === Shared HTTP session (keeps connections alive across reruns) ===
+@st.cache_resource
+def _http():
+    import requests
+    s = requests.Session()
+    s.headers["User-Agent"] = "iron-condor-app/1.0"
+    return s
+
+# The fetchers raise on failure instead of returning a fallback: st.cache_data
+# does not cache exceptions, so the next rerun retries the network. Defaults are
+# applied by the (uncached) caller.
+FALLBACK_BTC_PRICE = 107200
+
 # === Fetch BTC live price ===
+# Cached for 15s through fetch_market_data
 def fetch_live_btc_price():
-    try:
-        res = requests.get("https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd")
-        return res.json()['bitcoin']['usd']
-    except:
-        return 107200
+    res = _http().get("https://api.coingecko.com/api/v3/simple/price?ids=bitcoin&vs_currencies=usd", timeout=2.0)
+    res.raise_for_status()
+    return res.json()['bitcoin']['usd']
 
 # === Fetch option chain ===
+@st.cache_data(ttl=60)
 def fetch_deribit_option_chain():
     url = "https://www.deribit.com/api/v2/public/get_instruments"
     params = {"currency": "BTC", "kind": "option", "expired": "false"}
+    import orjson
+    res = _http().get(url, params=params, timeout=2.0)
+    res.raise_for_status()
+    rows = [r for r in orjson.loads(res.content)['result'] if r['is_active']]
+    n = len(rows)
+    cols = {
+        'instrument_name': np.array([r['instrument_name'] for r in rows], dtype=object),
+        'strike': np.fromiter((r['strike'] for r in rows), dtype=np.int32, count=n),
+        'option_type': np.array([r['option_type'] for r in rows], dtype=object),
+        'expiration_timestamp': np.fromiter((r['expiration_timestamp'] for r in rows), dtype=np.int64, count=n),
+    }
+    # sort the raw columns by strike so the DataFrame is built once, already ordered
+    order = np.argsort(cols['strike'], kind='stable')
+    return pd.DataFrame({k: v[order] for k, v in cols.items()})
+
+# === Fetch market data ===
+class MarketDataError(Exception):
+    # Raised (and so never cached) when either fetch fails; carries whichever result did load
+    def __init__(self, price, chain):
+        super().__init__("market data fetch failed")
+        self.price = price
+        self.chain = chain
+
+@st.cache_data(ttl=15)
+def fetch_market_data():
+    # Both fetches are network-bound, so overlap them instead of waiting on each in turn.
+    # This only runs on a cache miss; the workers get this run's script context so the
+    # cached fetchers they call behave as they would on the main thread.
+    ctx = get_script_run_ctx()
+    with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, ctx)) as ex:
+        f_price = ex.submit(fetch_live_btc_price)
+        f_chain = ex.submit(fetch_deribit_option_chain)
+        if f_price.exception() or f_chain.exception():
+            raise MarketDataError(None if f_price.exception() else f_price.result(),
+                                  None if f_chain.exception() else f_chain.result())
+        return f_price.result(), f_chain.result()
+
+# === Normal distribution (Abramowitz-Stegun polynomial) ===
+A1 = 0.31938153
+A2 = -0.356563782
+A3 = 1.781477937
+A4 = -1.821255978
+A5 = 1.330274429
+RSQRT2PI = 0.39894228040143267794
+
+def _npdf(d):
+    return RSQRT2PI * np.exp(-0.5 * d * d)
+
+def _cnd(d):
+    K = 1.0 / (1.0 + 0.2316419 * np.abs(d))
+    cnd = _npdf(d) * (K * (A1 + K * (A2 + K * (A3 + K * (A4 + K * A5)))))
+    return np.where(d > 0, 1.0 - cnd, cnd)
+
+# scipy's raw ndtr ufunc is full double precision without the scipy.stats.norm
+# dispatch overhead; the polynomial is the fallback when scipy is not installed
+@st.cache_resource
+def load_ncdf():
     try:
-        res = requests.get(url, params=params)
-        data = res.json()['result']
-        df = pd.DataFrame(data)
-        df = df[['instrument_name', 'strike', 'option_type', 'expiration_timestamp', 'is_active']]
-        df['expiration'] = pd.to_datetime(df['expiration_timestamp'], unit='ms')
-        return df[df['is_active']].sort_values(by='strike')
-    except:
-        return pd.DataFrame()
+        from scipy.special import ndtr
+    except ModuleNotFoundError:
+        return _cnd
+    return ndtr
 
 # === Greeks Calculator ===
-def calculate_greeks(S, K, T, r, sigma, option_type):
-    d1 = (math.log(S / K) + (r + sigma ** 2 / 2) * T) / (sigma * math.sqrt(T))
-    d2 = d1 - sigma * math.sqrt(T)
-
-    if option_type == "call":
-        delta = norm.cdf(d1)
-        gamma = norm.pdf(d1) / (S * sigma * math.sqrt(T))
-        theta = (-S * norm.pdf(d1) * sigma / (2 * math.sqrt(T))) - r * K * math.exp(-r * T) * norm.cdf(d2)
-        vega = S * norm.pdf(d1) * math.sqrt(T)
-    elif option_type == "put":
-        delta = -norm.cdf(-d1)
-        gamma = norm.pdf(d1) / (S * sigma * math.sqrt(T))
-        theta = (-S * norm.pdf(d1) * sigma / (2 * math.sqrt(T))) + r * K * math.exp(-r * T) * norm.cdf(-d2)
-        vega = S * norm.pdf(d1) * math.sqrt(T)
-    else:
-        raise ValueError("Invalid option type")
-
-    return {
-        'Delta': round(delta, 4),
-        'Gamma': round(gamma, 6),
-        'Theta': round(theta / 365, 4),  # daily
-        'Vega': round(vega / 100, 4)      # per 1% change in IV
-    }
+LEG_NAMES = ["Put Sell", "Put Buy", "Call Sell", "Call Buy"]
+LEG_FLAGS = np.array([-1.0, -1.0, 1.0, 1.0])  # put/put/call/call
+GREEK_NAMES = ["Delta", "Gamma", "Theta", "Vega"]
+
+def calculate_greeks_batch(S, K_arr, T, r, sigma, flags):
+    # flags: +1 for calls, -1 for puts; all legs are priced in one vectorized pass
+    sqrtT = math.sqrt(T)
+    vol_sqrtT = sigma * sqrtT
+    d1 = (np.log(S / K_arr) + (r + 0.5 * sigma * sigma) * T) / vol_sqrtT
+    d2 = d1 - vol_sqrtT
+    pdf1 = _npdf(d1)
+    disc = math.exp(-r * T)
+
+    # one CDF call over both d1 and d2 for every leg
+    cdf_sd1, cdf_sd2 = load_ncdf()(flags * np.stack((d1, d2)))
+
+    delta = flags * cdf_sd1
+    gamma = pdf1 / (S * vol_sqrtT)
+    theta = -S * pdf1 * sigma / (2 * sqrtT) - flags * r * K_arr * disc * cdf_sd2
+    vega = S * pdf1 * sqrtT
+
+    return np.stack([delta, gamma, theta / 365, vega / 100], axis=1)  # theta daily, vega per 1% IV
 
 # === UI Sidebar ===
 st.sidebar.header("Iron Condor Setup")
-option_chain = fetch_deribit_option_chain()
-unique_expiries = option_chain['expiration'].dt.date.unique() if not option_chain.empty else []
-selected_expiry = st.sidebar.selectbox("Choose Expiry", unique_expiries) if len(unique_expiries) else None
+try:
+    live_price, option_chain = fetch_market_data()
+except MarketDataError as e:
+    live_price = e.price if e.price is not None else FALLBACK_BTC_PRICE
+    option_chain = e.chain if e.chain is not None else pd.DataFrame()
+
+# Expiries are bucketed by UTC day straight from the millisecond timestamps
+MS_PER_DAY = 86_400_000
+
+def _utc_date(day):
+    return np.datetime64(int(day), 'D')
+
+expiry_ms = option_chain['expiration_timestamp'].to_numpy(np.int64) if not option_chain.empty else np.empty(0, np.int64)
+expiry_days = np.unique(expiry_ms // MS_PER_DAY)
+selected_day = st.sidebar.selectbox("Choose Expiry", expiry_days,
+                                    format_func=lambda d: str(_utc_date(d))) if len(expiry_days) else None
+selected_expiry = _utc_date(selected_day).item() if selected_day is not None else None
 
 if selected_expiry:
-    filtered_chain = option_chain[option_chain['expiration'].dt.date == selected_expiry]
+    filtered_chain = option_chain[expiry_ms // MS_PER_DAY == selected_day]
     st.subheader(f"Option Chain - {selected_expiry}")
     st.dataframe(filtered_chain[['strike', 'option_type']].reset_index(drop=True))
 else:
     filtered_chain = pd.DataFrame()
 
-live_price = fetch_live_btc_price()
 strikes = sorted(filtered_chain['strike'].unique()) if not filtered_chain.empty else [100000, 102000, 112000, 114000]
 
 put_sell_strike = st.sidebar.selectbox("Put Sell Strike", strikes, index=1)
@@ -105,49 +179,111 @@ break_even_high = call_sell_strike + total_credit
 
 # === Days to Expiry ===
 if selected_expiry:
-    today = datetime.utcnow().date()
+    today = datetime.now(timezone.utc).date()
     days_to_expiry = (selected_expiry - today).days
 else:
     days_to_expiry = 7
 
 # === Payoff Calculation ===
-def calculate_payoff(price):
-    put_payoff = np.where(price < put_sell_strike, np.minimum(put_sell_strike - price, put_spread_width), 0)
-    put_protection = np.where(price < put_buy_strike, (put_buy_strike - price), 0)
-    call_payoff = np.where(price > call_sell_strike, np.minimum(price - call_sell_strike, call_spread_width), 0)
-    call_protection = np.where(price > call_buy_strike, (price - call_buy_strike), 0)
-    return total_credit - (put_payoff - put_protection + call_payoff - call_protection)
+# Single precision is ample for a chart and halves the bytes through the kernels;
+# the Greeks stay float64
+PAYOFF_DTYPE = np.float32
+
+def _payoff_loop(price, pss, pbw, css, cbw, credit, out):
+    for i in range(price.shape[0]):
+        p = price[i]
+        a = pss - p
+        a = 0.0 if a < 0 else (pbw if a > pbw else a)
+        b = p - css
+        b = 0.0 if b < 0 else (cbw if b > cbw else b)
+        out[i] = credit - a - b
 
-price_range = np.linspace(spot_price - 10000, spot_price + 10000, 500)
-payoff = calculate_payoff(price_range)
+@st.cache_resource
+def load_payoff_kernel():
+    # Prefer the prebuilt Cython extension (no JIT warm-up), then numba;
+    # with neither available calculate_payoff falls back to np.clip
+    z = PAYOFF_DTYPE(0)
+    try:
+        from payoff_kernel import payoff
+        # a stale build with a different buffer dtype imports fine but rejects our arrays
+        payoff(np.zeros(1, PAYOFF_DTYPE), z, z, z, z, z, np.empty(1, PAYOFF_DTYPE))
+        return payoff
+    except (ImportError, ValueError, TypeError):
+        pass
+    try:
+        from numba import njit
+    except ModuleNotFoundError:
+        return None
+    kernel = njit(fastmath=True, cache=True)(_payoff_loop)
+    kernel(np.zeros(1, PAYOFF_DTYPE), z, z, z, z, z, np.empty(1, PAYOFF_DTYPE))  # compile once at startup
+    return kernel
+
+payoff_kernel = load_payoff_kernel()
+
+def calculate_payoff(price, put_sell_strike, put_spread_width, call_sell_strike, call_spread_width, total_credit):
+    if payoff_kernel is not None:
+        out = np.empty_like(price)
+        payoff_kernel(price, put_sell_strike, put_spread_width, call_sell_strike, call_spread_width, total_credit, out)
+        return out
+    # the long wings cap each short leg's loss at its spread width
+    return total_credit - np.clip(put_sell_strike - price, 0.0, put_spread_width) \
+                        - np.clip(price - call_sell_strike, 0.0, call_spread_width)
+
+@st.cache_data(max_entries=64)
+def compute_payoff(spot, pss, pbs, css, cbs, pss_p, pbs_p, css_p, cbs_p):
+    credit = (pss_p - pbs_p) + (css_p - cbs_p)
+    # The payoff is piecewise linear, so evaluating it at the window edges, the strikes
+    # and the break-evens is exact; the break-evens keep the profit/loss fills split at zero.
+    lo, hi = spot - 10000, spot + 10000
+    price_range = np.array([lo, pbs, pss, pss - credit, css + credit, css, cbs, hi], dtype=PAYOFF_DTYPE)
+    price_range = np.unique(price_range[(price_range >= lo) & (price_range <= hi)])
+    f = PAYOFF_DTYPE
+    return price_range, calculate_payoff(price_range, f(pss), f(pss - pbs), f(css), f(cbs - css), f(credit))
+
+@st.cache_data(max_entries=64)
+def compute_greeks_df(spot, strikes, T, r, sigma):
+    return pd.DataFrame(calculate_greeks_batch(spot, np.array(strikes), T, r, sigma, LEG_FLAGS),
+                        index=LEG_NAMES, columns=GREEK_NAMES)
+
+price_range, payoff = compute_payoff(
+    float(spot_price), float(put_sell_strike), float(put_buy_strike), float(call_sell_strike), float(call_buy_strike),
+    float(put_sell_premium), float(put_buy_premium), float(call_sell_premium), float(call_buy_premium))
 
 # === Greeks Display ===
 st.subheader("Greeks Summary")
-greek_data = {
-    "Put Sell": calculate_greeks(spot_price, put_sell_strike, days_to_expiry / 365, risk_free_rate, implied_vol, 'put'),
-    "Put Buy": calculate_greeks(spot_price, put_buy_strike, days_to_expiry / 365, risk_free_rate, implied_vol, 'put'),
-    "Call Sell": calculate_greeks(spot_price, call_sell_strike, days_to_expiry / 365, risk_free_rate, implied_vol, 'call'),
-    "Call Buy": calculate_greeks(spot_price, call_buy_strike, days_to_expiry / 365, risk_free_rate, implied_vol, 'call')
-}
-
-st.write(pd.DataFrame(greek_data).T)
+leg_strikes = (float(put_sell_strike), float(put_buy_strike), float(call_sell_strike), float(call_buy_strike))
+greeks_df = compute_greeks_df(float(spot_price), leg_strikes, days_to_expiry / 365, risk_free_rate, implied_vol)
+# round only for display; gamma is tiny for BTC-sized strikes so it keeps more places
+st.dataframe(greeks_df.style.format("{:.4f}").format("{:.6f}", subset=["Gamma"]))
 
 # === Payoff Plot ===
+import altair as alt
+
 st.subheader("Iron Condor Payoff Chart")
-fig, ax = plt.subplots(figsize=(12, 6))
-ax.plot(price_range, payoff, label='Payoff', color='orange')
-ax.axhline(0, color='gray', linestyle='--')
-ax.axvline(spot_price, color='blue', linestyle='--', label='Spot Price')
-ax.axvline(put_sell_strike, color='green', linestyle='--', label='Put Sell Strike')
-ax.axvline(call_sell_strike, color='red', linestyle='--', label='Call Sell Strike')
-ax.fill_between(price_range, payoff, where=payoff>0, color='green', alpha=0.1)
-ax.fill_between(price_range, payoff, where=payoff<0, color='red', alpha=0.1)
-ax.set_title("Payoff at Expiry")
-ax.set_xlabel("BTC Price")
-ax.set_ylabel("Profit / Loss (USD)")
-ax.legend()
-ax.grid(True)
-st.pyplot(fig)
+df_plot = pd.DataFrame({
+    'price': price_range,
+    'payoff': payoff,
+    'profit': np.maximum(payoff, 0),
+    'loss': np.minimum(payoff, 0),
+})
+df_lines = pd.DataFrame({
+    'label': ['Spot Price', 'Put Sell Strike', 'Call Sell Strike'],
+    'price': [spot_price, put_sell_strike, call_sell_strike],
+})
+x = alt.X('price:Q', title="BTC Price", scale=alt.Scale(zero=False))
+base = alt.Chart(df_plot).encode(x=x)
+chart = alt.layer(
+    base.mark_area(color='green', opacity=0.1).encode(y='profit:Q'),
+    base.mark_area(color='red', opacity=0.1).encode(y='loss:Q'),
+    base.mark_line(color='orange').encode(y=alt.Y('payoff:Q', title="Profit / Loss (USD)")),
+    alt.Chart(pd.DataFrame({'y': [0]})).mark_rule(color='gray', strokeDash=[4, 4]).encode(y='y:Q'),
+    alt.Chart(df_lines).mark_rule(strokeDash=[4, 4]).encode(
+        x=x,
+        color=alt.Color('label:N', title=None,
+                        scale=alt.Scale(domain=list(df_lines['label']), range=['blue', 'green', 'red'])),
+    ),
+).properties(title="Payoff at Expiry", height=450)
+st.altair_chart(chart, width="stretch")
 
 # === Strategy Summary ===
 st.subheader("Strategy Summary")
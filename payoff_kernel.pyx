@@ -0,0 +1,24 @@
+# distutils: extra_compile_args = -O3 -march=native -ffast-math
+# cython: boundscheck=False, wraparound=False, language_level=3
+
+# Ahead-of-time compiled payoff kernel, same contract as _payoff_loop in iron_condor_app.py.
+# Operates on float32 buffers to match PAYOFF_DTYPE.
+# Build in place with: cythonize -i -3 payoff_kernel.pyx
+
+def payoff(float[::1] price, float pss, float pbw, float css, float cbw,
+           float credit, float[::1] out):
+    cdef Py_ssize_t i, n = price.shape[0]
+    cdef float p, a, b
+    for i in range(n):
+        p = price[i]
+        a = pss - p
+        if a < 0:
+            a = 0
+        elif a > pbw:
+            a = pbw
+        b = p - css
+        if b < 0:
+            b = 0
+        elif b > cbw:
+            b = cbw
+        out[i] = credit - a - b